@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from pathlib import Path
+from page_tasks import (EXTRACT_TIMEOUT, ISOLATE, PAGE_TIMEOUT, RETRY, PageCheckpoint, WorkerPool,
+                        ocr_page_task)
+from parallel_parsing_pdf import extract_text_features_measured
+from pipeline_metrics import PipelineMetrics, profiled
+from predict_headings import enrich_with_nlp, load_model, predict_outline
+
+
+def write_json(path, data):
+    # Write to a sibling temp file and rename, so readers never see a partial outline
+    tmp_path = Path(path).with_name(f"{Path(path).name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AsyncPipeline:
+    # Overlaps the pipeline stages across documents:
+    #   - extraction and OCR run in a process pool (CPU bound, GIL free),
+    #   - spaCy and prediction run on one dedicated thread, since the model
+    #     is loaded once in this process and is not shared between threads,
+    #   - output writes go to a small I/O thread pool.
+    # NLP starts on a document's text pages while its scanned pages are still
+    # being OCR'd, so end-to-end time tends towards the slowest stage.
+
+    def __init__(self, output_folder="output", max_workers=None, max_documents=4, metrics=None,
+                 checkpoint_dir="output/checkpoints", page_timeout=PAGE_TIMEOUT, extract_timeout=EXTRACT_TIMEOUT):
+        self.output_folder = Path(output_folder)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_documents = max_documents
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.checkpoint_dir = checkpoint_dir
+        self.page_timeout = page_timeout
+        self.extract_timeout = extract_timeout
+        # (pdf name, page number) of every page whose OCR gave up
+        self.failed_pages = []
+        self.clf, self.le = load_model()
+
+    def start(self):
+        # Pools stay up between batches so long-running callers keep warm workers
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        self.workers = WorkerPool(self.max_workers, self.page_timeout)
+        self.nlp_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nlp")
+        self.io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="io")
+
+    def close(self):
+        self.workers.close()
+        self.nlp_pool.shutdown()
+        self.io_pool.shutdown()
+
+    async def run_cpu(self, fn, *args, timeout=None):
+        # One attempt under WorkerPool's policy (see page_tasks). At most one
+        # task per worker is in flight, so a task's deadline starts when it
+        # actually starts running rather than when it queued.
+        async with self.cpu_slots:
+            solo = False
+            while True:
+                # Suspects of a pool crash run one at a time
+                async with self.solo_slot if solo else nullcontext():
+                    pool, future = self.workers.submit(fn, *args, solo=solo)
+                    try:
+                        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+                    except asyncio.TimeoutError:
+                        self.workers.kill(pool)
+                        raise TimeoutError(f"no result after {timeout}s") from None
+                    except BrokenProcessPool:
+                        action = self.workers.broken(pool)
+                        if action == RETRY:
+                            raise
+                        solo = action == ISOLATE
+
+    async def process_batch(self, pdf_files, on_result=None):
+        self.loop = asyncio.get_running_loop()
+        # Bound documents in flight so a large batch does not queue every page at once
+        self.documents = asyncio.Semaphore(self.max_documents)
+        self.cpu_slots = asyncio.Semaphore(self.max_workers)
+        self.solo_slot = asyncio.Lock()
+        self.tasks, self.dropped = {}, set()
+
+        async def process(pdf_path):
+            try:
+                result = await self.process_document(Path(pdf_path))
+            except asyncio.CancelledError:
+                if pdf_path not in self.dropped:
+                    raise
+                print(f"⚠️ Dropped {Path(pdf_path).name}")
+                return None
+            except Exception as e:
+                result = e
+            if on_result is not None:
+                on_result(pdf_path, result)
+            return result
+
+        with self.metrics.stage("pipeline") as pipeline:
+            self.tasks = {p: asyncio.ensure_future(process(p)) for p in pdf_files}
+            results = await asyncio.gather(*self.tasks.values())
+            pipeline["lines"] = sum(r for r in results if isinstance(r, int))
+
+        for pdf_path, result in zip(pdf_files, results):
+            if isinstance(result, Exception):
+                print(f"❌ Failed to process {Path(pdf_path).name}: {result}")
+        return results
+
+    def drop(self, pdf_path):
+        # Abandons one document of the running batch (e.g. another worker now
+        # owns it); on_result is not called for it and its checkpoint is kept
+        task = self.tasks.get(pdf_path)
+        if task is not None and not task.done():
+            self.dropped.add(pdf_path)
+            task.cancel()
+
+    async def run(self, pdf_files):
+        self.start()
+        try:
+            return await self.process_batch(pdf_files)
+        finally:
+            self.close()
+
+    def output_path(self, pdf_path):
+        return self.output_folder / f"{pdf_path.stem}.json"
+
+    async def enrich(self, lines, pdf_name):
+        for line in lines:
+            line["pdf_name"] = pdf_name
+        return await self.loop.run_in_executor(
+            self.nlp_pool, enrich_with_nlp, lines, self.metrics, pdf_name
+        )
+
+    async def ocr_page(self, pdf_path, page_num):
+        # Bounded retries, each at the next lower DPI
+        dpis = self.workers.dpis
+        for attempt, dpi in enumerate(dpis):
+            try:
+                lines, records = await self.run_cpu(
+                    ocr_page_task, str(pdf_path), page_num, dpi, self.page_timeout,
+                    timeout=self.workers.deadline
+                )
+                self.metrics.extend(records)
+                return lines
+            except Exception as e:
+                error = e
+                if attempt + 1 < len(dpis):
+                    print(f"  ↻ Retrying {pdf_path.name} page {page_num + 1} at {dpis[attempt + 1]} dpi ({e})")
+        raise error
+
+    async def ocr_and_enrich(self, pdf_path, page_num, checkpoint):
+        lines = checkpoint.get(f"ocr:{page_num}")
+        if lines is None:
+            try:
+                lines = await self.ocr_page(pdf_path, page_num)
+            except Exception as e:
+                print(f"❌ OCR failed for {pdf_path.name} page {page_num + 1}: {e}")
+                self.failed_pages.append((pdf_path.name, page_num))
+                return []
+            await self.loop.run_in_executor(self.io_pool, checkpoint.save, f"ocr:{page_num}", lines)
+        return await self.enrich(lines, pdf_path.name)
+
+    async def process_document(self, pdf_path):
+        async with self.documents:
+            checkpoint = PageCheckpoint(self.checkpoint_dir, pdf_path)
+            extracted = checkpoint.get("text")
+            if extracted is None:
+                print(f"📄 Parsing: {pdf_path.name}")
+                features, ocr_tasks, records = await self.run_cpu(
+                    extract_text_features_measured, str(pdf_path), timeout=self.extract_timeout
+                )
+                self.metrics.extend(records)
+                await self.loop.run_in_executor(
+                    self.io_pool, checkpoint.save, "text", {"features": features, "ocr_tasks": ocr_tasks}
+                )
+            else:
+                print(f"📄 Resuming: {pdf_path.name} (text pages from checkpoint)")
+                features, ocr_tasks = extracted["features"], extracted["ocr_tasks"]
+
+            # Text pages go to NLP straight away; each scanned page follows as soon as its OCR finishes
+            parts = await asyncio.gather(
+                self.enrich(features, pdf_path.name),
+                *(self.ocr_and_enrich(pdf_path, page_num, checkpoint) for _, page_num in ocr_tasks)
+            )
+            enriched = [line for part in parts for line in part]
+
+            outline = await self.loop.run_in_executor(
+                self.nlp_pool, predict_outline, enriched, self.clf, self.le, self.metrics, pdf_path.name
+            )
+
+        output_path = self.output_path(pdf_path)
+        final_output = {"title": pdf_path.name, "outline": outline}
+        with self.metrics.stage("write", pdf_path.name, lines=len(outline)):
+            await self.loop.run_in_executor(self.io_pool, write_json, output_path, final_output)
+        checkpoint.clear()
+        print(f"✅ {pdf_path.name}: {len(outline)} headings → {output_path}")
+        return len(enriched)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Predict heading outlines with overlapping pipeline stages")
+    parser.add_argument("--input", default="input")
+    parser.add_argument("--output", default="output")
+    parser.add_argument("--workers", type=int, default=None, help="processes for extraction and OCR")
+    parser.add_argument("--max-documents", type=int, default=4, help="documents in flight at once")
+    parser.add_argument("--metrics", help="write per-stage metrics to this .json or .csv file")
+    parser.add_argument("--profile", help="write a cProfile dump of the whole run to this file")
+    parser.add_argument("--checkpoint-dir", default="output/checkpoints", help="per-document partial results")
+    parser.add_argument("--page-timeout", type=int, default=PAGE_TIMEOUT, help="seconds allowed per OCR page attempt")
+    parser.add_argument("--extract-timeout", type=int, default=EXTRACT_TIMEOUT,
+                        help="seconds allowed for a document's text extraction")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pdf_files = sorted(Path(args.input).glob("*.pdf"))
+    if not pdf_files:
+        print(f"❌ No PDFs found in {args.input}/")
+        return
+
+    metrics = PipelineMetrics()
+    pipeline = AsyncPipeline(args.output, args.workers, args.max_documents, metrics,
+                             args.checkpoint_dir, args.page_timeout, args.extract_timeout)
+    with profiled(args.profile):
+        asyncio.run(pipeline.run(pdf_files))
+
+    print("⏱️ Stage timings:")
+    metrics.print_summary()
+    if args.metrics:
+        print(f"📊 Metrics written to {metrics.write(args.metrics)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Neighbour-context features shared by training and inference. Each is 0
+# when the line has no neighbour on the same page in that direction.
+# Lines are grouped by their 0-based "page", which text and OCR lines share,
+# and positions are in PDF points for both.
+CONTEXT_FEATURES = ["gap_above", "gap_below", "font_size_delta", "indent_delta"]
+
+
+def _column(entries, key, default=0.0):
+    return np.fromiter((float(e.get(key, default) or 0) for e in entries), dtype=float, count=len(entries))
+
+
+def document_ids(entries, pages):
+    # Lines are grouped by pdf_name, which every extractor and the labeled
+    # rebuild (feature version 4+) now carry. Only as a last resort for older
+    # unnamed data is a drop in page number taken as the start of the next
+    # document; that guess merges documents whose pages keep rising.
+    names = [e.get("pdf_name") or "" for e in entries]
+    _, name_ids = np.unique(names, return_inverse=True)
+    unnamed = np.fromiter((not name for name in names), dtype=bool, count=len(names))
+    restarts = np.concatenate(([0], np.cumsum(np.diff(pages) < 0)))
+    return name_ids * (restarts[-1] + 1) + np.where(unnamed, restarts, 0)
+
+
+def add_context_features(entries):
+    n = len(entries)
+    if n == 0:
+        return entries
+
+    pages = _column(entries, "page")
+    tops = _column(entries, "y_position")
+    heights = _column(entries, "line_height")
+    font_sizes = _column(entries, "font_size")
+    lefts = _column(entries, "x_position")
+    docs = document_ids(entries, pages)
+
+    # Reading order: document, then page, then top to bottom
+    order = np.lexsort((tops, pages, docs))
+    tops, heights, font_sizes, lefts = tops[order], heights[order], font_sizes[order], lefts[order]
+    same_page = (docs[order][1:] == docs[order][:-1]) & (pages[order][1:] == pages[order][:-1])
+
+    # gaps[i] is the whitespace between sorted line i and line i + 1
+    gaps = np.where(same_page, tops[1:] - (tops[:-1] + heights[:-1]), 0.0)
+    font_steps = np.where(same_page, font_sizes[1:] - font_sizes[:-1], 0.0)
+    indent_steps = np.where(same_page, lefts[1:] - lefts[:-1], 0.0)
+
+    columns = np.zeros((len(CONTEXT_FEATURES), n))
+    columns[0, order[1:]] = gaps           # gap_above
+    columns[1, order[:-1]] = gaps          # gap_below
+    columns[2, order[1:]] = font_steps     # font_size_delta vs previous line
+    columns[3, order[1:]] = indent_steps   # indent_delta vs previous line
+
+    for entry, values in zip(entries, columns.T.tolist()):
+        entry.update(zip(CONTEXT_FEATURES, values))
+    return entries
@@ -1,13 +1,8 @@
 import pathlib
 import pymupdf
-import os
 import json
 import numpy as np
-import io
-import pytesseract
-from PIL import Image
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import time
+from page_tasks import OcrTaskRunner
 
 
 def extract_text_features(pdf_path):
@@ -16,7 +11,8 @@ def extract_text_features(pdf_path):
     ocr_tasks = []
 
     for page in doc:
-        blocks = page.get_text("dict").get("blocks", [])
+        # TEXTFLAGS_TEXT: like the "dict" default, minus copying raw image bytes
+        blocks = page.get_text("dict", flags=pymupdf.TEXTFLAGS_TEXT).get("blocks", [])
         page_num = page.number
         has_text = any("lines" in block for block in blocks)
 
@@ -67,58 +63,6 @@ def extract_text_features(pdf_path):
     return features, ocr_tasks
 
 
-def ocr_page(pdf_path, page_num, dpi=150):
-    doc = pymupdf.open(pdf_path)
-    page = doc[page_num]
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
-
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-    n = len(data["text"])
-
-    lines = {}
-    for i in range(n):
-        txt = data["text"][i].strip()
-        if not txt:
-            continue
-        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
-        left, top = data["left"][i], data["top"][i]
-        width, height = data["width"][i], data["height"][i]
-
-        if key not in lines:
-            lines[key] = {"words": [], "lefts": [], "tops": [], "rights": [], "bottoms": []}
-        grp = lines[key]
-        grp["words"].append(txt)
-        grp["lefts"].append(left)
-        grp["tops"].append(top)
-        grp["rights"].append(left + width)
-        grp["bottoms"].append(top + height)
-
-    enriched_lines = []
-    for grp in lines.values():
-        text = " ".join(grp["words"])
-        x0 = min(grp["lefts"])
-        y0 = min(grp["tops"])
-        x1 = max(grp["rights"])
-        y1 = max(grp["bottoms"])
-        line_width = x1 - x0
-        line_height = y1 - y0
-        char_count = len(text)
-
-        enriched_lines.append({
-            "text": text,
-            "font_size": 0,
-            "line_width": line_width,
-            "line_height": line_height,
-            "char_count": char_count,
-            "page": page_num + 1,
-            "y_position": y0
-        })
-
-    doc.close()
-    return enriched_lines
-
-
 def main():
     input_folder = pathlib.Path("input")
     output_folder = pathlib.Path("output")
@@ -149,30 +93,19 @@ def main():
 
     if all_ocr_tasks:
         print(f"🔍 Running OCR fallback for {len(all_ocr_tasks)} pages...")
-        future_to_task = {}
-        
-        with ProcessPoolExecutor() as executor:
-            # Submit all OCR tasks with both path and name
-            for task in all_ocr_tasks:
-                future = executor.submit(
-                    ocr_page, 
-                    task["pdf_path"], 
-                    task["page_num"]
-                )
-                future_to_task[future] = task
-            
-            # Process results as they complete
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                try:
-                    lines = future.result()
-                    for line in lines:
-                        # Add PDF name to each extracted line
-                        line["pdf_name"] = task["pdf_name"]
-                    all_features.extend(lines)
-                    print(f"  ✓ OCR completed for {task['pdf_name']} page {task['page_num']+1}")
-                except Exception as e:
-                    print(f"❌ OCR failed for {task['pdf_name']} page {task['page_num']+1}: {e}")
+
+        def on_result(task, lines):
+            for line in lines:
+                # Add PDF name to each extracted line
+                line["pdf_name"] = task["pdf_name"]
+            all_features.extend(lines)
+            print(f"  ✓ OCR completed for {task['pdf_name']} page {task['page_num']+1}")
+
+        def on_failure(task, error):
+            print(f"❌ OCR failed for {task['pdf_name']} page {task['page_num']+1}: {error}")
+
+        # Per-page deadlines, lower-DPI retries and worker recycling
+        OcrTaskRunner().run(all_ocr_tasks, on_result, on_failure)
 
     output_path = output_folder / "features.json"
     with open(output_path, "w", encoding="utf-8") as f:
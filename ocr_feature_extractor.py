@@ -1,17 +1,20 @@
+import argparse
 import pathlib
 import pymupdf  # modern import instead of fitz
 import io
 import os
 import pytesseract
 from PIL import Image
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import time
 import json
+from page_tasks import PAGE_TIMEOUT, OcrTaskRunner
+from parallel_parsing_pdf import close_pdf, ocr_task_source, open_pdf, read_source, source_name
+from pipeline_metrics import PipelineMetrics
 
 def is_page_empty(text):
     return not text.strip() or len(text.strip()) < 10
 
-def ocr_page_with_features(pdf_path, page_num, dpi=150):
+def ocr_page_with_features(pdf_path, page_num, dpi=150, metrics=None, timeout=0):
     import pymupdf
     from PIL import Image
     import pytesseract
@@ -19,12 +22,21 @@ def ocr_page_with_features(pdf_path, page_num, dpi=150):
     import os
     import numpy as np
 
-    doc = pymupdf.open(pdf_path)
-    page = doc[page_num]
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    if metrics is None:
+        metrics = PipelineMetrics()
+    pdf_name = source_name(pdf_path)
+
+    with metrics.stage("rasterize", pdf_name, pages=1):
+        doc = open_pdf(pdf_path)
+        page = doc[page_num]
+        pix = page.get_pixmap(dpi=dpi)
+        img = Image.open(io.BytesIO(pix.tobytes("png")))
+        close_pdf(pdf_path, doc)
+    with metrics.stage("tesseract", pdf_name, pages=1):
+        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, timeout=timeout)
     n = len(data["text"])
+    # Pixels at the render DPI to PDF points, so lower-DPI retries match
+    scale = 72 / dpi
 
     lines = {}
     for i in range(n):
@@ -33,8 +45,8 @@ def ocr_page_with_features(pdf_path, page_num, dpi=150):
             continue
 
         key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
-        left, top = data["left"][i], data["top"][i]
-        width, height = data["width"][i], data["height"][i]
+        left, top = data["left"][i] * scale, data["top"][i] * scale
+        width, height = data["width"][i] * scale, data["height"][i] * scale
 
         if key not in lines:
             lines[key] = {
@@ -73,21 +85,47 @@ def ocr_page_with_features(pdf_path, page_num, dpi=150):
             "starts_with_digit": text.strip()[0].isdigit() if text.strip() else False
         })
 
-    return (os.path.basename(pdf_path), page_num + 1, enriched_lines)
-
-def process_pdf_extract_features(pdf_path, ocr_executor, scheduled_tasks):
-    doc = pymupdf.open(pdf_path)
-    for page in doc:
-        text = page.get_text("text")
-        page_num = page.number
-        if is_page_empty(text):
-            future = ocr_executor.submit(ocr_page_with_features, str(pdf_path), page_num)
-            scheduled_tasks.append(future)
-        else:
-            print(f"[{pdf_path.name} Page {page_num+1}] Parsed (text mode):\n{text}\n")
-    doc.close()
+    return (pdf_name, page_num + 1, enriched_lines)
+
+def ocr_page_with_features_measured(pdf_path, page_num, dpi=150, timeout=0):
+    # Worker-side entry point for OcrTaskRunner
+    metrics = PipelineMetrics()
+    result = ocr_page_with_features(pdf_path, page_num, dpi=dpi, metrics=metrics, timeout=timeout)
+    return result, metrics.records
+
+def process_pdf_extract_features(pdf_path, ocr_tasks, metrics=None):
+    # pdf_path may be a path, bytes, a file-like object or a SharedPdf. Tasks
+    # for bytes or file-like input share one SharedPdf instead of each
+    # carrying the bytes; free it with release_ocr_tasks() after OCR.
+    if metrics is None:
+        metrics = PipelineMetrics()
+    pdf_name = source_name(pdf_path)
+    pdf_path = read_source(pdf_path)
+    task_source = None
+
+    with metrics.stage("open", pdf_name):
+        doc = open_pdf(pdf_path)
+    with metrics.stage("ocr_triage", pdf_name, pages=len(doc)) as triage:
+        for page in doc:
+            text = page.get_text("text")
+            page_num = page.number
+            if is_page_empty(text):
+                if task_source is None:
+                    task_source = ocr_task_source(pdf_path, pdf_name)
+                ocr_tasks.append({"pdf_path": task_source, "page_num": page_num, "pdf_name": pdf_name})
+            else:
+                triage["lines"] += len(text.splitlines())
+                print(f"[{pdf_name} Page {page_num+1}] Parsed (text mode):\n{text}\n")
+    close_pdf(pdf_path, doc)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print text and OCR line features for PDFs in input/")
+    parser.add_argument("--metrics", help="write per-stage metrics to this .json or .csv file")
+    parser.add_argument("--page-timeout", type=int, default=PAGE_TIMEOUT, help="seconds allowed per OCR page attempt")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     start_time = time.time()
     folder = pathlib.Path("input")
     pdf_files = list(folder.glob("*.pdf"))
@@ -96,23 +134,33 @@ def main():
         print("❌ No PDFs found in input folder.")
         return
 
-    scheduled_tasks = []
+    ocr_tasks = []
+    metrics = PipelineMetrics()
+
+    for pdf_file in pdf_files:
+        process_pdf_extract_features(pdf_file, ocr_tasks, metrics)
+
+    with metrics.stage("ocr", pages=len(ocr_tasks)) as ocr_stage:
+        def on_result(task, result):
+            pdf_name, page_num, lines = result
+            ocr_stage["lines"] += len(lines)
+            for line in lines:
+                print(f"[{pdf_name} Page {page_num}] Line: {line['text']}")
+                print(f"  Features: {json.dumps(line, indent=2)}\n")
 
-    with ProcessPoolExecutor() as ocr_executor:
-        for pdf_file in pdf_files:
-            process_pdf_extract_features(pdf_file, ocr_executor, scheduled_tasks)
+        def on_failure(task, error):
+            print(f"❌ OCR failed for {task['pdf_name']} page {task['page_num']+1}: {error}")
 
-        for future in as_completed(scheduled_tasks):
-            try:
-                pdf_name, page_num, lines = future.result()
-                for line in lines:
-                    print(f"[{pdf_name} Page {page_num}] Line: {line['text']}")
-                    print(f"  Features: {json.dumps(line, indent=2)}\n")
-            except Exception as e:
-                print(f"❌ OCR failed: {e}")
+        # Per-page deadlines, lower-DPI retries and worker recycling
+        runner = OcrTaskRunner(page_timeout=args.page_timeout, metrics=metrics,
+                               ocr_fn=ocr_page_with_features_measured)
+        runner.run(ocr_tasks, on_result, on_failure)
 
     elapsed = time.time() - start_time
     print(f"⏱️ Script completed in {elapsed:.2f} seconds")
+    metrics.print_summary()
+    if args.metrics:
+        print(f"📊 Metrics written to {metrics.write(args.metrics)}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,239 @@
+import json
+import os
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from parallel_parsing_pdf import ocr_page_measured
+from pipeline_metrics import PipelineMetrics
+
+# Each retry drops to the next resolution: pathological pages are often
+# huge scans that rasterize or OCR far faster at a lower DPI.
+OCR_DPIS = (150, 100, 72)
+PAGE_TIMEOUT = 60
+TASKS_PER_WORKER = 50
+
+# Text extraction of a whole document in one worker; a malformed PDF can
+# make MuPDF spin, so it gets a deadline too (generous: it covers every page)
+EXTRACT_TIMEOUT = 300
+
+# Extra time the parent allows on top of the tesseract timeout before it
+# assumes the worker itself (e.g. rasterization) is stuck.
+DEADLINE_GRACE = 15
+
+# WorkerPool.broken() outcomes for a task whose pool broke
+RETRY = "retry"        # it broke the pool while running alone: use up an attempt
+ISOLATE = "isolate"    # one of several suspects: re-run it alone
+RESUBMIT = "resubmit"  # its pool was killed for another task's deadline
+
+
+def ocr_page_task(pdf_path, page_num, dpi, timeout, ocr_fn=ocr_page_measured):
+    try:
+        return ocr_fn(pdf_path, page_num, dpi=dpi, timeout=timeout)
+    except Exception as e:
+        # Some OCR errors (e.g. TesseractNotFoundError) can't be unpickled in
+        # the parent, which would mark the whole pool as broken.
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def terminate_pool(executor):
+    # ProcessPoolExecutor has no public way to stop a running task, so hung
+    # workers are killed directly. shutdown() drops the process list, so it
+    # is taken first.
+    # Queued tasks are not cancelled: they fail with BrokenProcessPool
+    # instead, so callers see one error type for everything on the pool.
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False)
+    for process in processes:
+        process.terminate()
+
+
+class PageCheckpoint:
+    # Per-document JSONL of finished pages. The file name includes the PDF's
+    # size and mtime, so a replaced document never reuses stale pages.
+
+    def __init__(self, checkpoint_dir, pdf_path):
+        pdf_path = Path(pdf_path)
+        stat = pdf_path.stat()
+        self.path = Path(checkpoint_dir) / f"{pdf_path.stem}-{stat.st_size}-{stat.st_mtime_ns}.jsonl"
+        self.pages = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a crash mid-append
+                    self.pages[entry["page"]] = entry["data"]
+
+    def get(self, page):
+        return self.pages.get(page)
+
+    def save(self, page, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"page": page, "data": data}, ensure_ascii=False, default=float) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pages[page] = data
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+        self.pages = {}
+
+
+class WorkerPool:
+    # The process-pool policy shared by OcrTaskRunner and AsyncPipeline:
+    #   - a per-attempt deadline (tesseract's own timeout in the worker plus
+    #     DEADLINE_GRACE); a pool whose task misses it is killed and replaced,
+    #   - bounded retries, each at the next lower DPI,
+    #   - recycling after tasks_per_worker tasks per worker, which caps
+    #     memory growth from long-lived MuPDF/tesseract workers,
+    #   - crash isolation: a pool that breaks on its own takes every task it
+    #     was running with it, so those tasks are re-run one at a time on a
+    #     1-worker pool, and only a task that breaks that pool uses up an
+    #     attempt. Tasks on a pool killed for another task's deadline are
+    #     simply resubmitted.
+    # Tasks and results are pickled, so fn must be a module-level function.
+
+    def __init__(self, max_workers=None, page_timeout=PAGE_TIMEOUT, dpis=OCR_DPIS,
+                 tasks_per_worker=TASKS_PER_WORKER):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.page_timeout = page_timeout
+        self.deadline = page_timeout + DEADLINE_GRACE
+        self.dpis = dpis
+        self.recycle_after = tasks_per_worker * self.max_workers
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.submitted = 0
+        self.solo_pool = None
+        self.killed = weakref.WeakSet()
+
+    def submit(self, fn, *args, solo=False):
+        if solo:
+            if self.solo_pool is None:
+                self.solo_pool = ProcessPoolExecutor(max_workers=1)
+            pool = self.solo_pool
+        else:
+            if self.submitted >= self.recycle_after:
+                self.pool.shutdown(wait=False)  # lets in-flight tasks finish
+                self.pool, self.submitted = ProcessPoolExecutor(max_workers=self.max_workers), 0
+            self.submitted += 1
+            pool = self.pool
+        return pool, pool.submit(fn, *args)
+
+    def kill(self, pool):
+        # A task on this pool missed its deadline
+        self.killed.add(pool)
+        self._replace(pool)
+
+    def broken(self, pool):
+        # What to do with a task that failed with BrokenProcessPool
+        if pool in self.killed:
+            return RESUBMIT
+        crashed_alone = pool is self.solo_pool
+        self._replace(pool)
+        return RETRY if crashed_alone else ISOLATE
+
+    def _replace(self, pool):
+        terminate_pool(pool)
+        if pool is self.pool:
+            self.pool, self.submitted = ProcessPoolExecutor(max_workers=self.max_workers), 0
+        elif pool is self.solo_pool:
+            self.solo_pool = None
+
+    def close(self, kill=False):
+        for pool in (self.pool, self.solo_pool):
+            if pool is None:
+                continue
+            if kill:
+                terminate_pool(pool)
+            else:
+                pool.shutdown()
+
+
+class OcrTaskRunner:
+    # Runs OCR page tasks under WorkerPool's deadline/retry/isolation policy.
+    # Only max_workers tasks are in flight, so submit time ~ start time.
+    # ocr_fn is sent to the workers, so it must be a module-level function
+    # with ocr_page_measured's signature, returning (result, records).
+
+    def __init__(self, max_workers=None, page_timeout=PAGE_TIMEOUT, dpis=OCR_DPIS,
+                 tasks_per_worker=TASKS_PER_WORKER, metrics=None, ocr_fn=ocr_page_measured):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.page_timeout = page_timeout
+        self.dpis = dpis
+        self.tasks_per_worker = tasks_per_worker
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.ocr_fn = ocr_fn
+
+    def run(self, tasks, on_result, on_failure=None):
+        workers = WorkerPool(self.max_workers, self.page_timeout, self.dpis, self.tasks_per_worker)
+        queue = deque((task, 0) for task in tasks)
+        suspects = deque()  # tasks from a pool that broke, re-run one at a time
+        in_flight = {}
+
+        def retry_or_fail(task, attempt, error):
+            if attempt + 1 < len(self.dpis):
+                print(f"  ↻ Retrying {task['pdf_name']} page {task['page_num'] + 1} "
+                      f"at {self.dpis[attempt + 1]} dpi ({error})")
+                queue.append((task, attempt + 1))
+            elif on_failure is not None:
+                on_failure(task, error)
+
+        def submit(task, attempt, solo):
+            pool, future = workers.submit(
+                ocr_page_task, task["pdf_path"], task["page_num"], self.dpis[attempt], self.page_timeout,
+                self.ocr_fn, solo=solo
+            )
+            in_flight[future] = (task, attempt, pool, solo, time.monotonic() + workers.deadline)
+
+        def on_broken(task, attempt, pool, error):
+            action = workers.broken(pool)
+            if action == RETRY:
+                retry_or_fail(task, attempt, error)
+            elif action == ISOLATE:
+                suspects.append((task, attempt))
+            else:
+                queue.appendleft((task, attempt))
+
+        try:
+            while queue or suspects or in_flight:
+                if suspects and not any(solo for _, _, _, solo, _ in in_flight.values()):
+                    submit(*suspects.popleft(), solo=True)
+                while queue and sum(not solo for _, _, _, solo, _ in in_flight.values()) < self.max_workers:
+                    submit(*queue.popleft(), solo=False)
+
+                next_deadline = min(deadline for *_, deadline in in_flight.values())
+                done, _ = wait(in_flight, timeout=max(0, next_deadline - time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    task, attempt, pool, _, _ = in_flight.pop(future)
+                    try:
+                        lines, records = future.result()
+                    except BrokenProcessPool as e:
+                        on_broken(task, attempt, pool, e)
+                    except Exception as e:
+                        retry_or_fail(task, attempt, e)
+                    else:
+                        self.metrics.extend(records)
+                        on_result(task, lines)
+
+                now = time.monotonic()
+                for future, (task, attempt, pool, _, deadline) in list(in_flight.items()):
+                    if deadline > now or future not in in_flight:
+                        continue
+                    del in_flight[future]
+                    workers.kill(pool)
+                    retry_or_fail(task, attempt, TimeoutError(f"no result after {workers.deadline}s"))
+                    # Everything else on the killed pool goes back without using up an attempt
+                    for other, (o_task, o_attempt, o_pool, _, _) in list(in_flight.items()):
+                        if o_pool is pool:
+                            del in_flight[other]
+                            on_broken(o_task, o_attempt, o_pool, None)
+        except BaseException:
+            workers.close(kill=True)
+            raise
+        workers.close()
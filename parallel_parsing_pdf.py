@@ -1,3 +1,4 @@
+import argparse
 import pathlib
 import pymupdf
 import os
@@ -5,8 +6,10 @@ import json
 import numpy as np
 import io
 import pytesseract
+import time
+from multiprocessing import shared_memory
 from PIL import Image
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from pipeline_metrics import PipelineMetrics, cpu_time
 
 
 def get_next_available_filename(folder, base_name="label", extension=".json"):
@@ -19,80 +22,283 @@ def get_next_available_filename(folder, base_name="label", extension=".json"):
         i += 1
 
 
-def extract_text_features(pdf_path):
-    doc = pymupdf.open(pdf_path)
+class SharedPdf:
+    # PDF bytes held in shared memory. It pickles as just its name and size,
+    # so pool workers attach to the same bytes instead of each page task
+    # receiving its own copy. The creating process owns it and must unlink().
+
+    def __init__(self, name, size, shm_name):
+        self.name = name
+        self.size = size
+        self.shm_name = shm_name
+        # Set when extraction created it for in-memory input; such copies
+        # are freed by release_ocr_tasks() rather than by the caller
+        self.owned_by_tasks = False
+        self._shm = None
+
+    @classmethod
+    def create(cls, data, name="document.pdf"):
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        shared = cls(name, len(data), shm.name)
+        shared._shm = shm
+        return shared
+
+    def __getstate__(self):
+        return {"name": self.name, "size": self.size, "shm_name": self.shm_name,
+                "owned_by_tasks": self.owned_by_tasks, "_shm": None}
+
+    def unlink(self):
+        _release_shared(self.shm_name)
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+
+# Shared documents opened in this process, most recent last. PyMuPDF reads
+# straight from the shared buffer, so a worker parses each document once no
+# matter how many of its pages it OCRs.
+_shared_docs = {}
+MAX_SHARED_DOCS = 4
+
+
+def _open_shared(shared):
+    entry = _shared_docs.pop(shared.shm_name, None)
+    if entry is None:
+        shm = shared_memory.SharedMemory(name=shared.shm_name)
+        view = shm.buf[:shared.size]
+        entry = (shm, view, pymupdf.open(stream=view, filetype="pdf"))
+    _shared_docs[shared.shm_name] = entry
+    while len(_shared_docs) > MAX_SHARED_DOCS:
+        _release_shared(next(iter(_shared_docs)))
+    return entry[2]
+
+
+def _release_shared(shm_name):
+    entry = _shared_docs.pop(shm_name, None)
+    if entry is not None:
+        shm, view, doc = entry
+        # The document holds pointers into the buffer, so close it first
+        doc.close()
+        view.release()
+        shm.close()
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def source_name(source):
+    if is_path(source):
+        return pathlib.Path(source).name
+    if isinstance(source, SharedPdf):
+        return source.name
+    return pathlib.Path(getattr(source, "name", None) or "document.pdf").name
+
+
+def read_source(source):
+    # File-like objects can only be read once; later stages need the bytes again
+    if hasattr(source, "read"):
+        return source.read()
+    return source
+
+
+def open_pdf(source):
+    # Accepts a path, raw bytes (bytes/bytearray/memoryview) or a SharedPdf
+    if isinstance(source, SharedPdf):
+        return _open_shared(source)
+    if is_path(source):
+        return pymupdf.open(source)
+    return pymupdf.open(stream=source, filetype="pdf")
+
+
+def close_pdf(source, doc):
+    # Shared documents stay cached for the next task on the same PDF
+    if not isinstance(source, SharedPdf):
+        doc.close()
+
+
+def ocr_task_source(source, name):
+    # OCR tasks are pickled to a worker once per page. Paths and SharedPdfs
+    # are cheap to send; raw bytes would be copied for every page, so they
+    # are moved into shared memory owned by the tasks.
+    if is_path(source):
+        return str(source)
+    if isinstance(source, SharedPdf):
+        return source
+    shared = SharedPdf.create(source, name)
+    shared.owned_by_tasks = True
+    return shared
+
+
+def release_ocr_tasks(ocr_tasks):
+    # Frees shared memory that extraction set up for in-memory input. Call it
+    # once the tasks' OCR is done; SharedPdfs passed in by the caller stay
+    # the caller's to unlink.
+    for task in ocr_tasks:
+        source = task["pdf_path"] if isinstance(task, dict) else task[0]
+        if isinstance(source, SharedPdf) and source.owned_by_tasks:
+            source.unlink()
+
+
+# "dict" extraction defaults to TEXTFLAGS_DICT, which adds TEXT_PRESERVE_IMAGES
+# and copies every image's raw bytes into the result. TEXTFLAGS_TEXT is the same
+# set of text flags without it, so image blocks are never materialized.
+LEAN_TEXT_FLAGS = pymupdf.TEXTFLAGS_TEXT
+
+
+def extract_text_features(pdf_path, metrics=None, lean=True):
+    # pdf_path may also be bytes, a file-like object or a SharedPdf. OCR tasks
+    # for bytes or file-like input carry a SharedPdf; free it with
+    # release_ocr_tasks() once they have run.
+    flags = LEAN_TEXT_FLAGS if lean else pymupdf.TEXTFLAGS_DICT
+    if metrics is None:
+        metrics = PipelineMetrics()
+    pdf_name = source_name(pdf_path)
+    pdf_path = read_source(pdf_path)
+    task_source = None
+
+    with metrics.stage("open", pdf_name) as opened:
+        doc = open_pdf(pdf_path)
+        opened["pages"] = len(doc)
     features = []
     ocr_tasks = []
+    triage_wall = triage_cpu = 0.0
+
+    try:
+        with metrics.stage("text_extraction", pdf_name, pages=len(doc)) as extraction:
+            for page in doc:
+                blocks = page.get_text("dict", flags=flags).get("blocks", [])
+                page_num = page.number
+
+                wall_start, cpu_start = time.perf_counter(), cpu_time()
+                has_text = any("lines" in block for block in blocks)
+                triage_wall += time.perf_counter() - wall_start
+                triage_cpu += cpu_time() - cpu_start
+
+                if not has_text:
+                    if task_source is None:
+                        task_source = ocr_task_source(pdf_path, pdf_name)
+                    ocr_tasks.append((task_source, page_num))
+                    continue
 
-    for page in doc:
-        blocks = page.get_text("dict").get("blocks", [])
-        page_num = page.number
-        has_text = any("lines" in block for block in blocks)
+                features.extend(lines_from_blocks(blocks, page_num))
+            extraction["lines"] = len(features)
+    except BaseException:
+        release_ocr_tasks(ocr_tasks)
+        raise
+
+    # Triage is reported as its own stage, so it is kept out of extraction time
+    extraction["wall_time_s"] -= triage_wall
+    extraction["cpu_time_s"] -= triage_cpu
+    metrics.record("ocr_triage", pdf_name, triage_wall, triage_cpu, pages=len(ocr_tasks))
+    close_pdf(pdf_path, doc)
+    return features, ocr_tasks
 
-        if not has_text:
-            ocr_tasks.append((str(pdf_path), page_num))
-            continue
 
-        for block in blocks:
-            for line in block.get("lines", []):
-                line_text = []
-                font_sizes = []
-                x0s, x1s = [], []
-                y0s, y1s = [], []
-
-                for span in line.get("spans", []):
-                    text = span.get("text", "").strip()
-                    if not text:
-                        continue
-                    line_text.append(text)
-                    font_sizes.append(span.get("size", 0))
-                    bbox = span.get("bbox", [0, 0, 0, 0])
-                    x0s.append(bbox[0])
-                    x1s.append(bbox[2])
-                    y0s.append(bbox[1])
-                    y1s.append(bbox[3])
-
-                if not line_text:
+def extract_text_features_measured(pdf_path):
+    metrics = PipelineMetrics()
+    features, ocr_tasks = extract_text_features(pdf_path, metrics=metrics)
+    return features, ocr_tasks, metrics.records
+
+
+def lines_from_blocks(blocks, page_num):
+    features = []
+    for block in blocks:
+        for line in block.get("lines", []):
+            line_text = []
+            font_sizes = []
+            x0s, x1s = [], []
+            y0s, y1s = [], []
+            bold_chars = italic_chars = 0
+            font_name, font_chars = "", 0
+
+            for span in line.get("spans", []):
+                text = span.get("text", "").strip()
+                if not text:
                     continue
+                line_text.append(text)
+                font_sizes.append(span.get("size", 0))
+
+                # Span flags and font name come with the dict output for free
+                flags = span.get("flags", 0)
+                font = span.get("font", "")
+                if flags & pymupdf.TEXT_FONT_BOLD or "Bold" in font:
+                    bold_chars += len(text)
+                if flags & pymupdf.TEXT_FONT_ITALIC:
+                    italic_chars += len(text)
+                if len(text) > font_chars:
+                    font_name, font_chars = font, len(text)
+
+                bbox = span.get("bbox", [0, 0, 0, 0])
+                x0s.append(bbox[0])
+                x1s.append(bbox[2])
+                y0s.append(bbox[1])
+                y1s.append(bbox[3])
+
+            if not line_text:
+                continue
+
+            text_combined = " ".join(line_text)
+            font_size = np.median(font_sizes) if font_sizes else 0
+            line_width = max(x1s) - min(x0s) if x0s and x1s else 0
+            char_count = len(text_combined)
+            line_height = max(y1s) - min(y0s) if y0s and y1s else 0
+            y_position = min(y0s) if y0s else 0
+            x_position = min(x0s) if x0s else 0
+
+            features.append({
+                "text": text_combined,
+                "font_size": font_size,
+                "line_width": line_width,
+                "line_height": line_height,
+                "char_count": char_count,
+                "page": page_num,
+                "y_position": y_position,
+                "x_position": x_position,
+                "is_bold": bold_chars * 2 >= char_count,
+                "is_italic": italic_chars * 2 >= char_count,
+                "font_name": font_name
+            })
+    return features
 
-                text_combined = " ".join(line_text)
-                font_size = np.median(font_sizes) if font_sizes else 0
-                line_width = max(x1s) - min(x0s) if x0s and x1s else 0
-                char_count = len(text_combined)
-                line_height = max(y1s) - min(y0s) if y0s and y1s else 0
-                y_position = min(y0s) if y0s else 0
-
-                features.append({
-                    "text": text_combined,
-                    "font_size": font_size,
-                    "line_width": line_width,
-                    "line_height": line_height,
-                    "char_count": char_count,
-                    "page": page_num,
-                    "y_position": y_position
-                })
-
-    doc.close()
-    return features, ocr_tasks
 
+def ocr_page(pdf_path, page_num, dpi=150, metrics=None, timeout=0):
+    if metrics is None:
+        metrics = PipelineMetrics()
+    pdf_name = source_name(pdf_path)
 
-def ocr_page(pdf_path, page_num, dpi=150):
-    doc = pymupdf.open(pdf_path)
-    page = doc[page_num]
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
+    with metrics.stage("rasterize", pdf_name, pages=1):
+        doc = open_pdf(pdf_path)
+        page = doc[page_num]
+        pix = page.get_pixmap(dpi=dpi)
+        img = Image.open(io.BytesIO(pix.tobytes("png")))
 
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    with metrics.stage("tesseract", pdf_name, pages=1) as tesseract:
+        # timeout > 0 makes pytesseract kill a hung tesseract process and raise RuntimeError
+        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, timeout=timeout)
     n = len(data["text"])
 
+    # Tesseract boxes are in pixels at the render DPI; convert them to PDF
+    # points so OCR lines match text lines and a lower-DPI retry of the same
+    # page yields the same geometry.
+    scale = 72 / dpi
+
     lines = {}
     for i in range(n):
         txt = data["text"][i].strip()
         if not txt:
             continue
         key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
-        left, top = data["left"][i], data["top"][i]
-        width, height = data["width"][i], data["height"][i]
+        left, top = data["left"][i] * scale, data["top"][i] * scale
+        width, height = data["width"][i] * scale, data["height"][i] * scale
 
         if key not in lines:
             lines[key] = {"words": [], "lefts": [], "tops": [], "rights": [], "bottoms": []}
@@ -120,15 +326,36 @@ def ocr_page(pdf_path, page_num, dpi=150):
             "line_width": line_width,
             "line_height": line_height,
             "char_count": char_count,
-            "page": page_num + 1,
-            "y_position": y0
+            "page": page_num,  # 0-based, like text lines
+            "y_position": y0,
+            "x_position": x0,
+            "is_bold": False,
+            "is_italic": False,
+            "font_name": ""
         })
 
-    doc.close()
+    tesseract["lines"] = len(enriched_lines)
+    close_pdf(pdf_path, doc)
     return enriched_lines
 
 
+def ocr_page_measured(pdf_path, page_num, dpi=150, timeout=0):
+    # Worker-side entry point: metrics can't be shared across processes,
+    # so the stage records travel back alongside the OCR lines.
+    metrics = PipelineMetrics()
+    lines = ocr_page(pdf_path, page_num, dpi=dpi, metrics=metrics, timeout=timeout)
+    return lines, metrics.records
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract line features from PDFs in input/")
+    parser.add_argument("--metrics", help="write per-stage metrics to this .json or .csv file")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    metrics = PipelineMetrics()
     input_folder = pathlib.Path("input")
     output_folder = pathlib.Path("output")
     output_folder.mkdir(exist_ok=True)
@@ -143,36 +370,34 @@ def main():
 
     for pdf_path in pdf_files:
         print(f"📄 Extracting from: {pdf_path.name}")
-        text_features, ocr_tasks = extract_text_features(pdf_path)
+        text_features, ocr_tasks = extract_text_features(pdf_path, metrics=metrics)
+        for feat in text_features:
+            feat["pdf_name"] = pdf_path.name
         all_features.extend(text_features)
 
         for task in ocr_tasks:
             all_ocr_tasks.append({
                 "pdf_path": task[0],
-                "page_num": task[1]
+                "page_num": task[1],
+                "pdf_name": pdf_path.name
             })
 
     if all_ocr_tasks:
+        # Imported here: page_tasks builds on this module's OCR functions
+        from page_tasks import OcrTaskRunner
+
         print(f"🔍 Running OCR fallback for {len(all_ocr_tasks)} pages...")
-        future_to_task = {}
-
-        with ProcessPoolExecutor() as executor:
-            for task in all_ocr_tasks:
-                future = executor.submit(
-                    ocr_page,
-                    task["pdf_path"],
-                    task["page_num"]
-                )
-                future_to_task[future] = task
-
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                try:
-                    lines = future.result()
-                    all_features.extend(lines)
-                    print(f"  ✓ OCR completed for {task['pdf_path']} page {task['page_num']+1}")
-                except Exception as e:
-                    print(f"❌ OCR failed for {task['pdf_path']} page {task['page_num']+1}: {e}")
+
+        def on_result(task, lines):
+            for line in lines:
+                line["pdf_name"] = task["pdf_name"]
+            all_features.extend(lines)
+            print(f"  ✓ OCR completed for {task['pdf_name']} page {task['page_num']+1}")
+
+        def on_failure(task, error):
+            print(f"❌ OCR failed for {task['pdf_name']} page {task['page_num']+1}: {error}")
+
+        OcrTaskRunner(metrics=metrics).run(all_ocr_tasks, on_result, on_failure)
 
     output_path = get_next_available_filename(output_folder)
 
@@ -180,6 +405,10 @@ def main():
         json.dump(all_features, f, indent=2, ensure_ascii=False)
 
     print(f"✅ Saved {len(all_features)} text features to {output_path}")
+    print("⏱️ Stage timings:")
+    metrics.print_summary()
+    if args.metrics:
+        print(f"📊 Metrics written to {metrics.write(args.metrics)}")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,14 @@
+import argparse
 import pymupdf
 import pathlib
 import time  # <-- Import the time module
+from pipeline_metrics import PipelineMetrics
+
+parser = argparse.ArgumentParser(description="Print the text of every page of the PDFs in input/")
+parser.add_argument("--metrics", help="write per-stage metrics to this .json or .csv file")
+args = parser.parse_args()
+
+metrics = PipelineMetrics()
 
 start_time = time.time()  # <-- Start timing
 
@@ -8,13 +16,16 @@ folder = pathlib.Path("input")
 pdf_files = list(folder.glob("*.pdf"))
 
 for pdf_file in pdf_files:
-    doc = pymupdf.open(pdf_file)
+    with metrics.stage("open", pdf_file.name):
+        doc = pymupdf.open(pdf_file)
     for page in doc:
-        text = page.get_text("text")
+        with metrics.stage("text_extraction", pdf_file.name, pages=1):
+            text = page.get_text("text")
         if not text.strip():
             print("OCR FALLBACK")
-            tp = page.get_textpage_ocr()
-            text = page.get_text(textpage=tp)
+            with metrics.stage("ocr", pdf_file.name, pages=1):
+                tp = page.get_textpage_ocr()
+                text = page.get_text(textpage=tp)
             print(f"Text from {pdf_file.name}, page {page.number + 1}:\n{text}\n")
         else:
             print(f"Text from {pdf_file.name}, page {page.number + 1}:\n{text}\n")
@@ -23,3 +34,6 @@ for pdf_file in pdf_files:
 end_time = time.time()  # <-- End timing
 elapsed = end_time - start_time
 print(f"\n⏱️ Script completed in {elapsed:.2f} seconds")
+metrics.print_summary()
+if args.metrics:
+    print(f"📊 Metrics written to {metrics.write(args.metrics)}")
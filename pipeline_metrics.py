@@ -0,0 +1,215 @@
+import csv
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+METRIC_FIELDS = [
+    "stage", "document", "wall_time_s", "cpu_time_s",
+    "pages", "lines", "peak_rss_mb", "rss_growth_mb"
+]
+
+
+def peak_rss_mb():
+    # Highest RSS since the process started
+    if resource is None:
+        return 0.0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _proc_status_mb(field):
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024  # reported in kB
+    except OSError:
+        pass
+    return None
+
+
+def _reset_hwm():
+    # Writing 5 to clear_refs resets VmHWM (peak RSS) to the current RSS (Linux)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def cpu_time():
+    # Stages on helper threads (e.g. AsyncPipeline's NLP thread) count only
+    # their own thread; on the main thread, process time also covers any
+    # helper threads a stage fans out to.
+    if threading.current_thread() is threading.main_thread():
+        return time.process_time()
+    return time.thread_time()
+
+
+class _PeakTracker:
+    # Per-stage peak RSS. The kernel keeps one high-water mark per process,
+    # so each stage resets it on entry; before every reset the mark is folded
+    # into all stages still running, so nested and concurrent stages (threads)
+    # keep their own peaks. Without /proc (macOS, Windows) this falls back to
+    # the lifetime peak.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.resettable = _reset_hwm() and _proc_status_mb("VmHWM") is not None
+
+    def start(self):
+        if not self.resettable:
+            return {"rss": peak_rss_mb(), "peak": 0.0}
+        with self.lock:
+            hwm = _proc_status_mb("VmHWM")
+            for tracked in self.active:
+                tracked["peak"] = max(tracked["peak"], hwm)
+            _reset_hwm()
+            rss = _proc_status_mb("VmRSS")
+            tracked = {"rss": rss, "peak": rss}
+            self.active.append(tracked)
+        return tracked
+
+    def stop(self, tracked):
+        if not self.resettable:
+            peak = peak_rss_mb()
+            return peak, peak - tracked["rss"]
+        with self.lock:
+            self.active = [t for t in self.active if t is not tracked]
+            peak = max(tracked["peak"], _proc_status_mb("VmHWM"))
+        return peak, peak - tracked["rss"]
+
+
+_peaks = _PeakTracker()
+
+
+def _accumulate(totals, rec):
+    stage = totals.setdefault(rec["stage"], {
+        "stage": rec["stage"], "document": None, "wall_time_s": 0.0,
+        "cpu_time_s": 0.0, "pages": 0, "lines": 0,
+        "peak_rss_mb": 0.0, "rss_growth_mb": 0.0
+    })
+    stage["wall_time_s"] += rec["wall_time_s"]
+    stage["cpu_time_s"] += rec["cpu_time_s"]
+    stage["pages"] += rec["pages"]
+    stage["lines"] += rec["lines"]
+    stage["peak_rss_mb"] = max(stage["peak_rss_mb"], rec["peak_rss_mb"])
+    stage["rss_growth_mb"] += rec["rss_growth_mb"]
+
+
+class PipelineMetrics:
+    def __init__(self):
+        self.records = []
+        # Per-stage totals of records already flushed to disk
+        self.flushed = {}
+
+    @contextmanager
+    def stage(self, name, document=None, pages=0, lines=0):
+        record = {
+            "stage": name,
+            "document": document,
+            "pages": pages,
+            "lines": lines
+        }
+        tracked = _peaks.start()
+        wall_start = time.perf_counter()
+        cpu_start = cpu_time()
+        try:
+            yield record
+        finally:
+            record["wall_time_s"] = time.perf_counter() - wall_start
+            record["cpu_time_s"] = cpu_time() - cpu_start
+            record["peak_rss_mb"], record["rss_growth_mb"] = _peaks.stop(tracked)
+            self.records.append(record)
+
+    def record(self, name, document=None, wall_time_s=0.0, cpu_time_s=0.0, pages=0, lines=0):
+        # For stages timed by hand (no memory tracking of their own)
+        peak = _proc_status_mb("VmRSS") or peak_rss_mb()
+        self.records.append({
+            "stage": name,
+            "document": document,
+            "pages": pages,
+            "lines": lines,
+            "wall_time_s": wall_time_s,
+            "cpu_time_s": cpu_time_s,
+            "peak_rss_mb": peak,
+            "rss_growth_mb": 0.0
+        })
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def summary(self):
+        totals = {name: dict(stage) for name, stage in self.flushed.items()}
+        for rec in self.records:
+            _accumulate(totals, rec)
+        return list(totals.values())
+
+    def flush(self, *paths):
+        # For long-running processes: appends the pending records to each
+        # .jsonl or .csv file and keeps only per-stage totals in memory, so
+        # memory and write cost stay flat however many documents go by.
+        for path in paths:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path.suffix == ".csv":
+                new_file = not path.exists()
+                with open(path, "a", encoding="utf-8", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS, extrasaction="ignore")
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerows(self.records)
+            else:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(rec) + "\n" for rec in self.records)
+        for rec in self.records:
+            _accumulate(self.flushed, rec)
+        self.records = []
+
+    def write(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".csv":
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS)
+                writer.writeheader()
+                for rec in self.records:
+                    writer.writerow({k: rec.get(k) for k in METRIC_FIELDS})
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"stages": self.summary(), "records": self.records}, f, indent=2)
+        return path
+
+    def print_summary(self):
+        for stage in self.summary():
+            print(
+                f"  {stage['stage']:<16} wall {stage['wall_time_s']:8.3f}s  "
+                f"cpu {stage['cpu_time_s']:8.3f}s  pages {stage['pages']:5d}  "
+                f"lines {stage['lines']:7d}  peak {stage['peak_rss_mb']:8.1f} MB"
+            )
+
+
+@contextmanager
+def profiled(profile_path=None):
+    if profile_path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        Path(profile_path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(profile_path))
+        print(f"📊 cProfile stats written to {profile_path}")
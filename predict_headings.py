@@ -1,8 +1,11 @@
+import argparse
 import json
 import joblib
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from parallel_parsing_pdf import extract_text_features, ocr_page
+from context_features import add_context_features
+from page_tasks import PAGE_TIMEOUT, OcrTaskRunner, PageCheckpoint
+from parallel_parsing_pdf import extract_text_features, release_ocr_tasks, source_name
+from pipeline_metrics import PipelineMetrics, profiled
 import spacy
 
 # Load spaCy model
@@ -15,54 +18,187 @@ features_to_use = [
     "contains_year", "word_count", "avg_word_len", "named_entity_ratio"
 ]
 
-def run_parser_pipeline():
-    input_folder = Path("input")
-    output_folder = Path("output")
+def run_parser_pipeline(metrics=None, input_folder="input", output_folder="output",
+                        checkpoint_dir="output/checkpoints", page_timeout=PAGE_TIMEOUT):
+    if metrics is None:
+        metrics = PipelineMetrics()
+    input_folder = Path(input_folder)
+    output_folder = Path(output_folder)
     output_folder.mkdir(exist_ok=True)
 
     pdf_files = list(input_folder.glob("*.pdf"))
     if not pdf_files:
-        print("❌ No PDFs found in input/")
+        print(f"❌ No PDFs found in {input_folder}/")
         return None
 
     all_features = []
     all_ocr_tasks = []
+    checkpoints = {}
 
     for pdf_path in pdf_files:
-        print(f"📄 Parsing: {pdf_path.name}")
-        text_features, ocr_tasks = extract_text_features(pdf_path)
+        checkpoint = checkpoints[pdf_path.name] = PageCheckpoint(checkpoint_dir, pdf_path)
+        extracted = checkpoint.get("text")
+        if extracted is None:
+            print(f"📄 Parsing: {pdf_path.name}")
+            text_features, ocr_tasks = extract_text_features(pdf_path, metrics=metrics)
+            checkpoint.save("text", {"features": text_features, "ocr_tasks": ocr_tasks})
+        else:
+            print(f"📄 Resuming: {pdf_path.name} (text pages from checkpoint)")
+            text_features, ocr_tasks = extracted["features"], extracted["ocr_tasks"]
         for feat in text_features:
             feat["pdf_name"] = pdf_path.name
         all_features.extend(text_features)
 
         for task in ocr_tasks:
+            lines = checkpoint.get(f"ocr:{task[1]}")
+            if lines is not None:
+                all_features.extend(lines)
+                continue
             all_ocr_tasks.append({"pdf_path": task[0], "page_num": task[1], "pdf_name": pdf_path.name})
 
     if all_ocr_tasks:
         print(f"🔍 Running OCR on {len(all_ocr_tasks)} pages...")
-        with ProcessPoolExecutor() as executor:
-            future_to_task = {
-                executor.submit(ocr_page, task["pdf_path"], task["page_num"]): task
-                for task in all_ocr_tasks
-            }
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                try:
-                    lines = future.result()
-                    for line in lines:
-                        line["pdf_name"] = task["pdf_name"]
-                    all_features.extend(lines)
-                except Exception as e:
-                    print(f"❌ OCR failed for {task['pdf_path']} page {task['page_num'] + 1}: {e}")
+        with metrics.stage("ocr", pages=len(all_ocr_tasks)) as ocr_stage:
+            def on_result(task, lines):
+                for line in lines:
+                    line["pdf_name"] = task["pdf_name"]
+                checkpoints[task["pdf_name"]].save(f"ocr:{task['page_num']}", lines)
+                all_features.extend(lines)
+                ocr_stage["lines"] += len(lines)
+
+            def on_failure(task, error):
+                print(f"❌ OCR failed for {task['pdf_path']} page {task['page_num'] + 1}: {error}")
+
+            runner = OcrTaskRunner(page_timeout=page_timeout, metrics=metrics)
+            runner.run(all_ocr_tasks, on_result, on_failure)
 
     output_path = output_folder / "features.json"
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(all_features, f, indent=2, ensure_ascii=False)
+    with metrics.stage("write", "features.json", lines=len(all_features)):
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(all_features, f, indent=2, ensure_ascii=False)
+    for checkpoint in checkpoints.values():
+        checkpoint.clear()
     print(f"✅ Features written to {output_path}")
     return output_path
 
-def run_inference():
-    features_path = run_parser_pipeline()
+def enrich_with_nlp(parsed_data, metrics=None, document=None):
+    if metrics is None:
+        metrics = PipelineMetrics()
+
+    with metrics.stage("nlp", document, lines=len(parsed_data)):
+        # Fast batch NLP feature enrichment
+        texts = [entry.get("text", "") for entry in parsed_data]
+        docs = list(nlp.pipe(texts, batch_size=64))
+
+        enriched_data = []
+        for entry, doc in zip(parsed_data, docs):
+            text = entry.get("text", "")
+            is_all_caps = text.isupper()
+            is_title_case = text.istitle()
+            starts_with_number = text[:2].strip().split(" ")[0].isdigit() if text else False
+            contains_colon = ":" in text
+            contains_year = any(str(y) in text for y in range(1990, 2031))
+
+            words = [token.text for token in doc if token.is_alpha]
+            word_count = len(words)
+            avg_word_len = sum(len(w) for w in words) / word_count if word_count > 0 else 0
+            ner_count = len([ent for ent in doc.ents])
+            named_entity_ratio = ner_count / word_count if word_count > 0 else 0
+
+            entry.update({
+                "is_all_caps": is_all_caps,
+                "is_title_case": is_title_case,
+                "starts_with_number": starts_with_number,
+                "contains_colon": contains_colon,
+                "contains_year": contains_year,
+                "word_count": word_count,
+                "avg_word_len": avg_word_len,
+                "named_entity_ratio": named_entity_ratio
+            })
+            enriched_data.append(entry)
+    return enriched_data
+
+def predict_outline(enriched_data, clf, le, metrics=None, document=None):
+    if metrics is None:
+        metrics = PipelineMetrics()
+
+    with metrics.stage("context_features", document, lines=len(enriched_data)):
+        add_context_features(enriched_data)
+
+    # Models trained with context features record their feature list; older
+    # models were trained on features_to_use alone
+    model_features = getattr(clf, "heading_features", features_to_use)
+
+    with metrics.stage("feature_vectors", document, lines=len(enriched_data)):
+        rows = []
+        for entry in enriched_data:
+            try:
+                vec = [
+                    float(entry.get(f, 0)) if isinstance(entry.get(f), (int, float))
+                    else int(entry.get(f, False))
+                    for f in model_features
+                ]
+                rows.append((entry, vec))
+            except Exception as e:
+                print(f"⚠️ Skipping line due to error: {e}")
+
+    outline = []
+    with metrics.stage("predict", document, lines=len(rows)):
+        for entry, vec in rows:
+            try:
+                label_idx = clf.predict([vec])[0]
+                label = le.inverse_transform([label_idx])[0]
+
+                if label in ["H1", "H2", "H3"]:
+                    outline.append({
+                        "level": label,
+                        "text": entry["text"],
+                        "page": entry["page"]
+                    })
+            except Exception as e:
+                print(f"⚠️ Skipping line due to error: {e}")
+    return outline
+
+def load_model():
+    clf = joblib.load("models/heading_classifier.joblib")
+    le = joblib.load("models/label_encoder.joblib")
+    return clf, le
+
+def predict_document(source, clf=None, le=None, metrics=None, page_timeout=PAGE_TIMEOUT, name=None):
+    # In-memory entry point for services: source may be a path, PDF bytes, a
+    # file-like object or a SharedPdf. Extraction places in-memory input with
+    # scanned pages in shared memory, so OCR workers attach to it instead of
+    # being sent a copy per page.
+    if metrics is None:
+        metrics = PipelineMetrics()
+    if clf is None or le is None:
+        clf, le = load_model()
+    pdf_name = name or source_name(source)
+
+    features, ocr_tasks = extract_text_features(source, metrics=metrics)
+    try:
+        if ocr_tasks:
+            def on_result(task, lines):
+                features.extend(lines)
+
+            def on_failure(task, error):
+                print(f"❌ OCR failed for {pdf_name} page {task['page_num'] + 1}: {error}")
+
+            tasks = [{"pdf_path": task[0], "page_num": task[1], "pdf_name": pdf_name} for task in ocr_tasks]
+            OcrTaskRunner(page_timeout=page_timeout, metrics=metrics).run(tasks, on_result, on_failure)
+    finally:
+        release_ocr_tasks(ocr_tasks)
+
+    for feat in features:
+        feat["pdf_name"] = pdf_name
+    enriched_data = enrich_with_nlp(features, metrics, pdf_name)
+    outline = predict_outline(enriched_data, clf, le, metrics, pdf_name)
+    return {"title": pdf_name, "outline": outline}
+
+def run_inference(metrics=None, page_timeout=PAGE_TIMEOUT):
+    if metrics is None:
+        metrics = PipelineMetrics()
+    features_path = run_parser_pipeline(metrics, page_timeout=page_timeout)
     if features_path is None:
         return
 
@@ -70,60 +206,20 @@ def run_inference():
     with open(features_path, "r", encoding="utf-8") as f:
         parsed_data = json.load(f)
 
-    # Fast batch NLP feature enrichment
-    texts = [entry.get("text", "") for entry in parsed_data]
-    docs = list(nlp.pipe(texts, batch_size=64))
-
-    enriched_data = []
-    for entry, doc in zip(parsed_data, docs):
-        text = entry.get("text", "")
-        is_all_caps = text.isupper()
-        is_title_case = text.istitle()
-        starts_with_number = text[:2].strip().split(" ")[0].isdigit() if text else False
-        contains_colon = ":" in text
-        contains_year = any(str(y) in text for y in range(1990, 2031))
-
-        words = [token.text for token in doc if token.is_alpha]
-        word_count = len(words)
-        avg_word_len = sum(len(w) for w in words) / word_count if word_count > 0 else 0
-        ner_count = len([ent for ent in doc.ents])
-        named_entity_ratio = ner_count / word_count if word_count > 0 else 0
-
-        entry.update({
-            "is_all_caps": is_all_caps,
-            "is_title_case": is_title_case,
-            "starts_with_number": starts_with_number,
-            "contains_colon": contains_colon,
-            "contains_year": contains_year,
-            "word_count": word_count,
-            "avg_word_len": avg_word_len,
-            "named_entity_ratio": named_entity_ratio
-        })
-        enriched_data.append(entry)
-
     # Load model & label encoder
-    clf = joblib.load("models/heading_classifier.joblib")
-    le = joblib.load("models/label_encoder.joblib")
+    clf, le = load_model()
 
+    # One document at a time, so NLP and prediction are recorded per document
+    documents = {}
+    for entry in parsed_data:
+        documents.setdefault(entry.get("pdf_name"), []).append(entry)
+
+    enriched_data = []
     outline = []
-    for entry in enriched_data:
-        try:
-            vec = [
-                float(entry.get(f, 0)) if isinstance(entry.get(f), (int, float))
-                else int(entry.get(f, False))
-                for f in features_to_use
-            ]
-            label_idx = clf.predict([vec])[0]
-            label = le.inverse_transform([label_idx])[0]
-
-            if label in ["H1", "H2", "H3"]:
-                outline.append({
-                    "level": label,
-                    "text": entry["text"],
-                    "page": entry["page"]
-                })
-        except Exception as e:
-            print(f"⚠️ Skipping line due to error: {e}")
+    for pdf_name, entries in documents.items():
+        enriched = enrich_with_nlp(entries, metrics, pdf_name)
+        outline.extend(predict_outline(enriched, clf, le, metrics, pdf_name))
+        enriched_data.extend(enriched)
 
     final_output = {
         "title": enriched_data[0].get("pdf_name", "Untitled Document"),
@@ -131,9 +227,24 @@ def run_inference():
     }
 
     output_path = Path("output") / "output.json"
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(final_output, f, indent=2, ensure_ascii=False)
+    with metrics.stage("write", "output.json", lines=len(outline)):
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(final_output, f, indent=2, ensure_ascii=False)
     print(f"✅ Final predictions saved to {output_path}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Predict heading outlines for PDFs in input/")
+    parser.add_argument("--metrics", help="write per-stage metrics to this .json or .csv file")
+    parser.add_argument("--profile", help="write a cProfile dump of the whole run to this file")
+    parser.add_argument("--page-timeout", type=int, default=PAGE_TIMEOUT, help="seconds allowed per OCR page attempt")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    run_inference()
+    args = parse_args()
+    metrics = PipelineMetrics()
+    with profiled(args.profile):
+        run_inference(metrics, page_timeout=args.page_timeout)
+    print("⏱️ Stage timings:")
+    metrics.print_summary()
+    if args.metrics:
+        print(f"📊 Metrics written to {metrics.write(args.metrics)}")
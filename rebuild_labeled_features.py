@@ -1,5 +1,10 @@
+import argparse
+import glob
 import json
+import os
+import sys
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import spacy
 
@@ -59,63 +64,207 @@ def get_nlp_features(text):
     }
 
 
+# Bump whenever the record layout or any feature computation below changes;
+# batch relabeling regenerates every output built with an older version.
+FEATURE_VERSION = 4
+
+BATCH_SIZE = 256
+
+
+def build_labeled_record(entry, doc):
+    text = entry.get("text", "")
+
+    # Layout-based features
+    base = {
+        "text": text,
+        "font_size": entry.get("font_size", 0),
+        "line_width": entry.get("line_width", 0),
+        "line_height": entry.get("line_height", 0),
+        "char_count": entry.get("char_count", len(text)),
+        "page": entry.get("page", 0),
+        "y_position": entry.get("y_position", 0),
+        "x_position": entry.get("x_position", 0),
+        "is_bold": entry.get("is_bold", False),
+        "is_italic": entry.get("is_italic", False),
+        "font_name": entry.get("font_name", ""),
+        "pdf_name": entry.get("pdf_name", ""),
+        "label": entry.get("label")
+    }
+
+    # NLP-based features from pre-parsed doc
+    is_all_caps = text.isupper()
+    is_title_case = text.istitle()
+    starts_with_number = text[:2].strip().split(" ")[0].isdigit() if text else False
+    contains_colon = ":" in text
+    contains_year = any(str(y) in text for y in range(1990, 2031))
+
+    words = [token.text for token in doc if token.is_alpha]
+    word_count = len(words)
+    avg_word_len = sum(len(w) for w in words) / word_count if word_count > 0 else 0
+    ner_count = len([ent for ent in doc.ents])
+    named_entity_ratio = ner_count / word_count if word_count > 0 else 0
+
+    semantic_feats = {
+        "is_all_caps": is_all_caps,
+        "is_title_case": is_title_case,
+        "starts_with_number": starts_with_number,
+        "contains_colon": contains_colon,
+        "contains_year": contains_year,
+        "word_count": word_count,
+        "avg_word_len": avg_word_len,
+        "named_entity_ratio": named_entity_ratio
+    }
+
+    return {**base, **semantic_feats}
+
+
+def iter_json_array(path, chunk_size=1 << 16):
+    # Yields the items of a top-level JSON array without loading the whole file
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, eof, started = "", False, False
+        while True:
+            buf = buf.lstrip()
+            if not buf and not eof:
+                more = f.read(chunk_size)
+                eof = not more
+                buf += more
+                continue
+            if not started:
+                # Leading whitespace may span several chunks
+                if not buf.startswith("["):
+                    raise ValueError(f"{path} is not a JSON array")
+                buf, started = buf[1:], True
+                continue
+            if buf.startswith(","):
+                buf = buf[1:].lstrip()
+            if buf.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+                # A value is only complete once a delimiter follows it: a
+                # number cut at a chunk boundary ("-1" of "-1.5e10") decodes
+                # fine but may continue in the next chunk
+                complete = buf[end] in " \t\n\r,]" if end < len(buf) else eof
+                if eof and not complete:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buf, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                more = f.read(chunk_size)
+                eof = not more
+                buf += more
+                continue
+            yield item
+            buf = buf[end:]
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def rebuild_features_from_labeled_json(input_json: str, output_file: str):
-    with open(input_json, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    texts = [entry.get("text", "") for entry in data]
-    docs = list(nlp.pipe(texts, batch_size=64))
-
-    updated_records = []
-    for entry, doc in zip(data, docs):
-        text = entry.get("text", "")
-
-        # Layout-based features
-        base = {
-            "text": text,
-            "font_size": entry.get("font_size", 0),
-            "line_width": entry.get("line_width", 0),
-            "line_height": entry.get("line_height", 0),
-            "char_count": entry.get("char_count", len(text)),
-            "page": entry.get("page", 0),
-            "y_position": entry.get("y_position", 0),
-            "label": entry.get("label")
-        }
-
-        # NLP-based features from pre-parsed doc
-        is_all_caps = text.isupper()
-        is_title_case = text.istitle()
-        starts_with_number = text[:2].strip().split(" ")[0].isdigit() if text else False
-        contains_colon = ":" in text
-        contains_year = any(str(y) in text for y in range(1990, 2031))
-
-        words = [token.text for token in doc if token.is_alpha]
-        word_count = len(words)
-        avg_word_len = sum(len(w) for w in words) / word_count if word_count > 0 else 0
-        ner_count = len([ent for ent in doc.ents])
-        named_entity_ratio = ner_count / word_count if word_count > 0 else 0
-
-        semantic_feats = {
-            "is_all_caps": is_all_caps,
-            "is_title_case": is_title_case,
-            "starts_with_number": starts_with_number,
-            "contains_colon": contains_colon,
-            "contains_year": contains_year,
-            "word_count": word_count,
-            "avg_word_len": avg_word_len,
-            "named_entity_ratio": named_entity_ratio
-        }
-
-        combined = {**base, **semantic_feats}
-        updated_records.append(combined)
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(updated_records, f, indent=2, ensure_ascii=False)
-
-    print(f"✅ Saved enriched labeled dataset to {output_file}")
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + ".tmp")
+    count = 0
+
+    # Records are streamed in and out in batches; written compactly (one record
+    # per line) and renamed into place so a crash never leaves a truncated file
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write("[")
+        for batch in iter_batches(iter_json_array(input_json), BATCH_SIZE):
+            docs = nlp.pipe([entry.get("text", "") for entry in batch], batch_size=64)
+            for entry, doc in zip(batch, docs):
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(build_labeled_record(entry, doc), ensure_ascii=False))
+                count += 1
+        f.write("\n]\n")
+    os.replace(tmp_file, output_file)
+
+    print(f"✅ Saved enriched labeled dataset to {output_file} ({count} records)")
+    return count
+
+
+def metadata_path(output_file):
+    output_file = Path(output_file)
+    return output_file.with_name(output_file.name + ".meta")
+
+
+def source_stamp(input_json):
+    stat = Path(input_json).stat()
+    return {"feature_version": FEATURE_VERSION, "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def is_current(input_json, output_file):
+    meta = metadata_path(output_file)
+    if not Path(output_file).exists() or not meta.exists():
+        return False
+    with open(meta, "r", encoding="utf-8") as f:
+        return json.load(f) == source_stamp(input_json)
+
+
+def relabel_file(input_json, output_file, force=False):
+    if not force and is_current(input_json, output_file):
+        print(f"⏭️ {output_file} is current (feature version {FEATURE_VERSION})")
+        return 0
+    stamp = source_stamp(input_json)
+    count = rebuild_features_from_labeled_json(input_json, output_file)
+    with open(metadata_path(output_file), "w", encoding="utf-8") as f:
+        json.dump(stamp, f)
+    return count
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"⚠️ No files match {pattern}")
+        paths.extend(Path(m) for m in matches)
+    return list(dict.fromkeys(paths))
+
+
+def relabel_batch(patterns, output_dir=".", suffix="_upd", workers=None, force=False):
+    inputs = expand_inputs(patterns)
+    jobs = [(p, Path(output_dir) / f"{p.stem}{suffix}.json") for p in inputs]
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    # One file per worker process; each worker already has the spaCy model
+    # from the module import, so nothing is pickled but the paths
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        future_to_job = {executor.submit(relabel_file, src, dst, force): (src, dst) for src, dst in jobs}
+        for future in as_completed(future_to_job):
+            src, dst = future_to_job[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                print(f"❌ Failed to relabel {src}: {e}")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild NLP features for labeled datasets")
+    parser.add_argument("inputs", nargs="*", default=["output/kush.json"],
+                        help="labeled JSON files or glob patterns (e.g. 'output/label*.json')")
+    parser.add_argument("--output-dir", default=".", help="where <name>_upd.json files are written")
+    parser.add_argument("--suffix", default="_upd")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild even if outputs are current")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    input_path = "output/kush.json"
-    output_path = "kush_upd.json"
-    rebuild_features_from_labeled_json(input_path, output_path)
+    args = parse_args()
+    failures = relabel_batch(args.inputs, args.output_dir, args.suffix, args.workers, args.force)
+    sys.exit(1 if failures else 0)
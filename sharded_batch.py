@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from pathlib import Path
+from page_tasks import PAGE_TIMEOUT
+from pipeline_metrics import PipelineMetrics
+
+# Run directory layout, shared by every worker (local disk or NFS/SMB mount):
+#   manifest.txt           one PDF path per line; a document's id is its line number
+#   claims/<id>.lease      held by the worker processing that document
+#   done/<id>.json         written once the document's outline is on disk
+#   results/<id>.json      the document's outline
+#   metrics/<worker>.jsonl per-worker stage metrics, combined by `merge`
+#   checkpoints/           per-document partial results (see page_tasks)
+LEASE_SECONDS = 300
+POLL_SECONDS = 5
+MERGE_CHUNK = 10000
+
+
+def doc_id(index):
+    return f"{index:07d}"
+
+
+def write_atomic(path, data):
+    tmp_path = Path(path).with_name(f"{Path(path).name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_manifest(run_dir):
+    with open(Path(run_dir) / "manifest.txt", "r", encoding="utf-8") as f:
+        return [Path(line.strip()) for line in f if line.strip()]
+
+
+def init_run(run_dir, patterns):
+    run_dir = Path(run_dir)
+    pdfs = []
+    for pattern in patterns:
+        pdfs.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    pdfs = [str(Path(p).resolve()) for p in dict.fromkeys(pdfs) if p.lower().endswith(".pdf")]
+
+    for sub in ("claims", "done", "results", "metrics", "checkpoints"):
+        (run_dir / sub).mkdir(parents=True, exist_ok=True)
+    manifest = run_dir / "manifest.txt"
+    if manifest.exists():
+        print(f"⚠️ {manifest} already exists; leaving it unchanged")
+        return len(read_manifest(run_dir))
+    tmp_manifest = manifest.with_name("manifest.txt.tmp")
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        f.writelines(p + "\n" for p in pdfs)
+    os.replace(tmp_manifest, manifest)
+    print(f"✅ Manifest with {len(pdfs)} PDFs written to {manifest}")
+    return len(pdfs)
+
+
+class LeaseStore:
+    # Claims are files created with O_EXCL, which is atomic on local disks and
+    # NFSv3+. A holder refreshes its lease's mtime while working; a lease not
+    # refreshed for lease_seconds is considered abandoned and may be broken.
+
+    def __init__(self, run_dir, worker_id, lease_seconds=LEASE_SECONDS):
+        self.claims = Path(run_dir) / "claims"
+        self.done = Path(run_dir) / "done"
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+
+    def lease_path(self, doc):
+        return self.claims / f"{doc}.lease"
+
+    def is_done(self, doc):
+        return (self.done / f"{doc}.json").exists()
+
+    def claim(self, doc):
+        lease = self.lease_path(doc)
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self.break_if_expired(lease):
+                return False
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False  # another worker re-claimed it first
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"worker": self.worker_id, "claimed": time.time()}, f)
+
+        # The previous holder may have finished between our done check and the claim
+        if self.is_done(doc):
+            self.release(doc)
+            return False
+        return True
+
+    def break_if_expired(self, lease):
+        try:
+            if time.time() - lease.stat().st_mtime < self.lease_seconds:
+                return False
+            stale = lease.with_name(f"{lease.name}.{self.worker_id}.stale")
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return False
+
+        # Between the check and the rename another worker may have broken the
+        # lease and claimed it afresh, in which case we just moved its new
+        # lease aside. rename() keeps the mtime, so check the file we took.
+        if time.time() - stale.stat().st_mtime < self.lease_seconds:
+            try:
+                # Unlike rename(), link() never replaces a lease created meanwhile
+                os.link(stale, lease)
+            except FileExistsError:
+                pass
+            stale.unlink(missing_ok=True)
+            return False
+        print(f"♻️ Breaking abandoned lease {lease.name}")
+        stale.unlink(missing_ok=True)
+        return True
+
+    def heartbeat(self, docs):
+        # Refreshes our leases and returns the docs whose lease we have lost:
+        # broken while we stalled (missing) or since claimed by another worker
+        lost = []
+        for doc in docs:
+            lease = self.lease_path(doc)
+            try:
+                with open(lease, "r", encoding="utf-8") as f:
+                    holder = json.load(f).get("worker")
+                if holder == self.worker_id:
+                    os.utime(lease)
+                    continue
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass  # an empty lease is another worker's claim being written
+            lost.append(doc)
+        return lost
+
+    def release(self, doc):
+        self.lease_path(doc).unlink(missing_ok=True)
+
+
+def build_pipeline_class():
+    # Imported lazily so `init` and `merge` don't need spaCy or the model
+    from async_pipeline import AsyncPipeline
+
+    class ShardPipeline(AsyncPipeline):
+        # Results are named by document id, since PDFs from different folders may share a name
+        def __init__(self, doc_ids, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.doc_ids = doc_ids
+
+        def output_path(self, pdf_path):
+            return self.output_folder / f"{self.doc_ids[pdf_path]}.json"
+
+    return ShardPipeline
+
+
+async def run_worker(args):
+    run_dir = Path(args.run_dir)
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    manifest = read_manifest(run_dir)
+    leases = LeaseStore(run_dir, worker_id, args.lease_seconds)
+    metrics = PipelineMetrics()
+    metrics_path = run_dir / "metrics" / f"{worker_id}.jsonl"
+    doc_ids = {}
+    pipeline = build_pipeline_class()(
+        doc_ids, run_dir / "results", args.workers, args.max_documents, metrics,
+        run_dir / "checkpoints", args.page_timeout
+    )
+    pipeline.start()
+
+    def list_done():
+        return {name[:-5] for name in os.listdir(run_dir / "done") if name.endswith(".json")}
+
+    # Start each worker at a different point in the manifest to reduce claim
+    # contention. The cursor then moves on through the manifest from batch to
+    # batch, so claiming costs a few stats per document rather than a listing
+    # of done/ (which grows with the run) per batch.
+    offset = zlib.crc32(worker_id.encode()) % max(len(manifest), 1)
+    order = list(range(offset, len(manifest))) + list(range(offset))
+    cursor = 0
+    done = list_done()
+    processed = 0
+    print(f"🛠️ Worker {worker_id}: {len(manifest)} documents in manifest")
+
+    try:
+        while len(done) < len(manifest):
+            claimed = []
+            for _ in range(len(order)):
+                doc = doc_id(order[cursor])
+                cursor = (cursor + 1) % len(order)
+                if doc in done:
+                    continue
+                if leases.is_done(doc):
+                    done.add(doc)  # finished by another worker
+                    continue
+                if leases.claim(doc):
+                    claimed.append(doc)
+                    if len(claimed) == args.batch_size:
+                        break
+
+            if not claimed:
+                # A full pass found nothing to claim: everything left is leased
+                # by other workers. Wait in case one of them dies, then pick up
+                # whatever they finished meanwhile.
+                await asyncio.sleep(args.poll_interval)
+                done = list_done()
+                continue
+
+            pdfs = {manifest[int(doc)]: doc for doc in claimed}
+            doc_ids.update(pdfs)
+            active = set(claimed)
+
+            def on_result(pdf_path, result):
+                doc = pdfs[pdf_path]
+                marker = {"pdf": str(pdf_path), "worker": worker_id, "finished": time.time()}
+                if isinstance(result, Exception):
+                    marker.update(status="failed", error=str(result))
+                else:
+                    marker.update(status="done", lines=result)
+                write_atomic(run_dir / "done" / f"{doc}.json", marker)
+                leases.release(doc)
+                active.discard(doc)
+                done.add(doc)
+
+            async def keep_leases():
+                while True:
+                    await asyncio.sleep(args.lease_seconds / 3)
+                    for doc in leases.heartbeat(list(active)):
+                        # Another worker broke our lease (we stalled past
+                        # lease_seconds) and now owns the document
+                        print(f"⚠️ Lost lease on {doc}; leaving it to its new holder")
+                        active.discard(doc)
+                        pipeline.drop(manifest[int(doc)])
+
+            heartbeat = asyncio.ensure_future(keep_leases())
+            try:
+                results = await pipeline.process_batch(list(pdfs), on_result)
+            finally:
+                heartbeat.cancel()
+            processed += sum(result is not None for result in results)  # None: dropped
+            # Appended per batch, so memory and write cost don't grow with the run
+            metrics.flush(metrics_path)
+    finally:
+        pipeline.close()
+        metrics.flush(metrics_path)
+
+    print(f"✅ Worker {worker_id} finished ({processed} documents)")
+
+
+def merge_run(run_dir):
+    run_dir = Path(run_dir)
+    manifest = read_manifest(run_dir)
+    metrics = PipelineMetrics()
+    combined = [run_dir / "run_metrics.jsonl", run_dir / "run_metrics.csv"]
+    for path in combined:
+        path.unlink(missing_ok=True)
+
+    # Streamed through in chunks; a large run has far too many records to hold at once
+    for path in sorted((run_dir / "metrics").glob("*.jsonl")):
+        worker = path.stem
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line from a worker killed mid-append
+                record["worker"] = worker
+                metrics.extend([record])
+                if len(metrics.records) >= MERGE_CHUNK:
+                    metrics.flush(*combined)
+        metrics.flush(*combined)
+
+    statuses = {"done": 0, "failed": 0}
+    failed = []
+    for path in (run_dir / "done").glob("*.json"):
+        with open(path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+        statuses[marker["status"]] = statuses.get(marker["status"], 0) + 1
+        if marker["status"] == "failed":
+            failed.append({"id": path.stem, "pdf": marker["pdf"], "error": marker.get("error")})
+
+    write_atomic(run_dir / "run_metrics.json", {"stages": metrics.summary()})
+    summary = {
+        "documents": len(manifest),
+        "done": statuses["done"],
+        "failed": statuses["failed"],
+        "pending": len(manifest) - statuses["done"] - statuses["failed"],
+        "failures": failed
+    }
+    write_atomic(run_dir / "summary.json", summary)
+
+    print(f"📊 {summary['done']} done, {summary['failed']} failed, {summary['pending']} pending "
+          f"of {summary['documents']} documents")
+    metrics.print_summary()
+    return summary
+
+
+def run_local(args):
+    # Convenience mode: several independent worker processes on this host
+    # against the same run directory, exactly as separate hosts would run.
+    init_run(args.run_dir, args.inputs)
+    worker_args = [
+        "--run-dir", args.run_dir, "--batch-size", str(args.batch_size),
+        "--lease-seconds", str(args.lease_seconds), "--poll-interval", str(args.poll_interval),
+        "--page-timeout", str(args.page_timeout), "--max-documents", str(args.max_documents)
+    ]
+    if args.workers:
+        worker_args += ["--workers", str(args.workers)]
+    procs = [
+        subprocess.Popen([sys.executable, __file__, "work", "--worker-id", f"local-{i}", *worker_args])
+        for i in range(args.processes)
+    ]
+    codes = [p.wait() for p in procs]
+    summary = merge_run(args.run_dir)
+    return 0 if not any(codes) and summary["pending"] == 0 else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sharded batch processing over a shared directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    init = sub.add_parser("init", help="write the manifest for a run")
+    init.add_argument("--run-dir", required=True)
+    init.add_argument("inputs", nargs="+", help="PDF files or glob patterns")
+
+    def add_worker_options(p):
+        p.add_argument("--run-dir", required=True)
+        p.add_argument("--batch-size", type=int, default=8, help="documents claimed at a time")
+        p.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+        p.add_argument("--poll-interval", type=float, default=POLL_SECONDS)
+        p.add_argument("--workers", type=int, default=None, help="extraction/OCR processes per worker")
+        p.add_argument("--max-documents", type=int, default=4)
+        p.add_argument("--page-timeout", type=int, default=PAGE_TIMEOUT)
+
+    work = sub.add_parser("work", help="claim and process documents until the manifest is finished")
+    add_worker_options(work)
+    work.add_argument("--worker-id", help="defaults to <hostname>-<pid>")
+
+    merge = sub.add_parser("merge", help="combine worker metrics and summarize the run")
+    merge.add_argument("--run-dir", required=True)
+
+    local = sub.add_parser("run-local", help="init, run N workers on this host, then merge")
+    add_worker_options(local)
+    local.add_argument("--processes", type=int, default=2, help="independent workers to start")
+    local.add_argument("inputs", nargs="+", help="PDF files or glob patterns")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "init":
+        init_run(args.run_dir, args.inputs)
+    elif args.command == "work":
+        asyncio.run(run_worker(args))
+    elif args.command == "merge":
+        merge_run(args.run_dir)
+    elif args.command == "run-local":
+        sys.exit(run_local(args))
@@ -0,0 +1,89 @@
+import random
+import pathlib
+import pymupdf
+
+WORDS = [
+    "cuisine", "market", "olive", "garlic", "region", "harbour", "village", "wine",
+    "tomato", "herbs", "coast", "season", "bread", "cheese", "festival", "recipe",
+    "lavender", "history", "table", "fresh", "local", "dish", "sauce", "summer"
+]
+
+# Base-14 fonts ship with every PDF viewer, so no font files are needed
+BODY_FONTS = ["helv", "tiro", "cour"]
+DEFAULT_FONTS = ["helv"]
+HEADING_FONTS = {"helv": "hebo", "tiro": "tibo", "cour": "cobo"}
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+
+
+def _sentence(rng, min_words, max_words):
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return " ".join(words).capitalize()
+
+
+def _fill_page(page, rng, heading_density, fonts):
+    y = MARGIN
+    headings = 0
+    while y < PAGE_HEIGHT - MARGIN:
+        font = rng.choice(fonts)
+        if rng.random() < heading_density:
+            size = rng.choice([20, 16, 13])
+            text = _sentence(rng, 2, 5).title()
+            fontname = HEADING_FONTS.get(font, font)
+            y += size * 0.6  # whitespace above a heading
+            headings += 1
+        else:
+            size = 10
+            text = _sentence(rng, 6, 12)
+            fontname = font
+        page.insert_text((MARGIN, y + size), text, fontsize=size, fontname=fontname)
+        y += size * 1.5
+    return headings
+
+
+def _noise_image(rng, size=256):
+    # Random pixels barely compress, so each image keeps a realistic payload
+    samples = bytes(rng.getrandbits(8) for _ in range(size * size * 3))
+    return pymupdf.Pixmap(pymupdf.csRGB, size, size, samples, False)
+
+
+def generate_pdf(path, pages=10, heading_density=0.1, fonts=None, scanned_pages=0, seed=0, dpi=100,
+                 images_per_page=0):
+    # The last `scanned_pages` pages are rasterized and re-inserted as images,
+    # so they carry no text layer and exercise the OCR path. `images_per_page`
+    # adds photo-like images under the text, as in image-heavy brochures.
+    rng = random.Random(seed)
+    fonts = fonts or DEFAULT_FONTS
+    doc = pymupdf.open()
+    headings = 0
+
+    for page_num in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        for i in range(images_per_page):
+            x = MARGIN + (i % 2) * 250
+            y = MARGIN + (i // 2 % 3) * 250
+            page.insert_image(pymupdf.Rect(x, y, x + 230, y + 230), pixmap=_noise_image(rng), overlay=False)
+        headings += _fill_page(page, rng, heading_density, fonts)
+
+        if page_num >= pages - scanned_pages:
+            pix = page.get_pixmap(dpi=dpi)
+            doc.delete_page(page_num)
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            page.insert_image(page.rect, pixmap=pix)
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return {
+        "path": str(path),
+        "pages": pages,
+        "scanned_pages": scanned_pages,
+        "headings": headings
+    }
+
+
+if __name__ == "__main__":
+    info = generate_pdf("input/synthetic.pdf", pages=5, heading_density=0.15, scanned_pages=1)
+    print(f"✅ Generated {info['path']} ({info['pages']} pages, {info['headings']} headings)")
@@ -5,6 +5,7 @@ from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 from sklearn.utils.multiclass import unique_labels
+from context_features import CONTEXT_FEATURES, add_context_features
 
 # Load enriched feature dataset
 with open("label_all.json", "r", encoding="utf-8") as f:
@@ -25,7 +26,10 @@ features_to_use = [
     "word_count",
     "avg_word_len",
     "named_entity_ratio"
-]
+] + CONTEXT_FEATURES
+
+# Same neighbour-context stage as inference (predict_headings.predict_outline)
+add_context_features(data)
 
 X = []
 y = []
@@ -57,6 +61,8 @@ X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2,
 # Train the XGBoost classifier
 clf = XGBClassifier(n_estimators=100, use_label_encoder=False, eval_metric="mlogloss", random_state=42)
 clf.fit(X_train, y_train)
+# Saved with the model so inference builds vectors in the same order
+clf.heading_features = features_to_use
 
 # Evaluate
 y_pred = clf.predict(X_test)
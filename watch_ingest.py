@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import time
+from pathlib import Path
+from async_pipeline import AsyncPipeline
+from page_tasks import PAGE_TIMEOUT
+from pipeline_metrics import PipelineMetrics
+
+
+def document_key(pdf_path):
+    # Name + size + mtime identifies a dropped file without re-reading its bytes
+    stat = pdf_path.stat()
+    return f"{pdf_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ProcessedLedger:
+    # Append-only JSONL record of finished documents. Each line is fsync'd
+    # before the next document is considered done, so after a crash the
+    # ledger never claims work whose output was not written.
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a crash mid-append
+                    self.entries[entry["key"]] = entry
+
+    def status(self, key):
+        entry = self.entries.get(key)
+        return entry["status"] if entry else None
+
+    def record(self, key, pdf_path, status, error=None):
+        entry = {
+            "key": key,
+            "pdf": str(pdf_path),
+            "status": status,
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[key] = entry
+
+
+class QueuePipeline(AsyncPipeline):
+    # Queue files list PDFs from anywhere, and two folders may hold the same
+    # name, so outputs get a hash of the full path after the stem
+    def output_path(self, pdf_path):
+        digest = hashlib.sha1(str(Path(pdf_path).resolve()).encode("utf-8")).hexdigest()[:10]
+        return self.output_folder / f"{pdf_path.stem}-{digest}.json"
+
+
+def queued_pdfs(input_folder=None, queue_file=None):
+    if queue_file is not None:
+        queue_file = Path(queue_file)
+        if not queue_file.exists():
+            return []
+        with open(queue_file, "r", encoding="utf-8") as f:
+            paths = [Path(line.strip()) for line in f if line.strip()]
+        return [p for p in paths if p.suffix.lower() == ".pdf"]
+    return sorted(Path(input_folder).glob("*.pdf"))
+
+
+def pending_pdfs(candidates, ledger, settle_seconds, retry_failed=False):
+    pending = []
+    now = time.time()
+    for pdf_path in candidates:
+        try:
+            # Skip files that are still being copied in
+            if now - pdf_path.stat().st_mtime < settle_seconds:
+                continue
+            key = document_key(pdf_path)
+        except FileNotFoundError:
+            continue
+        status = ledger.status(key)
+        if status == "done" or (status == "failed" and not retry_failed):
+            continue
+        pending.append((pdf_path, key))
+    return pending
+
+
+async def watch(args):
+    ledger = ProcessedLedger(args.ledger)
+    metrics = PipelineMetrics()
+    pipeline_class = QueuePipeline if args.queue_file else AsyncPipeline
+    pipeline = pipeline_class(args.output, args.workers, args.max_documents, metrics,
+                              args.checkpoint_dir, args.page_timeout)
+    pipeline.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows event loops
+            pass
+
+    source = args.queue_file or args.input
+    print(f"👀 Watching {source} (ledger: {args.ledger})")
+    # Keys tried since the last idle poll. With --retry-failed a failing
+    # document would otherwise be pending again straight after its batch;
+    # this way it is retried at most once per poll interval.
+    attempted = set()
+    try:
+        while not stop.is_set():
+            candidates = queued_pdfs(args.input, args.queue_file)
+            pending = [
+                (pdf_path, key)
+                for pdf_path, key in pending_pdfs(candidates, ledger, args.settle, args.retry_failed)
+                if key not in attempted
+            ][:args.batch_size]
+
+            if pending:
+                keys = dict(pending)
+                attempted.update(keys.values())
+
+                # Record each document as soon as its output is on disk
+                def on_result(pdf_path, result):
+                    if isinstance(result, Exception):
+                        ledger.record(keys[pdf_path], pdf_path, "failed", result)
+                    else:
+                        ledger.record(keys[pdf_path], pdf_path, "done")
+
+                await pipeline.process_batch(list(keys), on_result)
+                if args.metrics:
+                    metrics.flush(args.metrics)
+                else:
+                    metrics.flush()  # keep only the running totals in memory
+                continue  # more files may already be waiting
+
+            if args.once:
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=args.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            attempted.clear()
+    finally:
+        pipeline.close()
+        print("👋 Ingestion stopped")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Continuously ingest PDFs dropped into a folder or queue file")
+    parser.add_argument("--input", default="input", help="folder to watch for new PDFs")
+    parser.add_argument("--queue-file", help="read PDF paths (one per line) from this file instead of --input")
+    parser.add_argument("--output", default="output")
+    parser.add_argument("--ledger", default="output/processed.jsonl", help="durable record of finished documents")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between scans")
+    parser.add_argument("--settle", type=float, default=1.0, help="ignore files modified within this many seconds")
+    parser.add_argument("--batch-size", type=int, default=16, help="documents handed to the pipeline per scan")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-documents", type=int, default=4)
+    parser.add_argument("--retry-failed", action="store_true", help="reprocess documents recorded as failed")
+    parser.add_argument("--once", action="store_true", help="drain what is queued now, then exit")
+    parser.add_argument("--metrics", help="append per-stage metrics records to this .jsonl or .csv file after every batch")
+    parser.add_argument("--checkpoint-dir", default="output/checkpoints", help="per-document partial results")
+    parser.add_argument("--page-timeout", type=int, default=PAGE_TIMEOUT, help="seconds allowed per OCR page attempt")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(watch(parse_args()))